@@ -1,13 +1,17 @@
+import asyncio
 from asyncio.log import logger
-import datetime
+import concurrent.futures
+import contextlib
+import functools
 import io
 import os
 import pathlib
-from typing import List, Union, Optional, TYPE_CHECKING
+from typing import AsyncIterator, List, Literal, Union, Optional, TYPE_CHECKING
 import urllib.parse
 from PIL import Image
 
-from aiobotocore.session import get_session
+from aiobotocore.session import AioSession, get_session
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 import aiohttp
@@ -17,12 +21,50 @@ from chat_exporter.ext.discord_import import discord
 if TYPE_CHECKING:
     from types_aiobotocore_s3.client import S3Client
 
+# objects larger than the threshold are sent as a multipart upload, with the parts uploaded concurrently
+_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+_MULTIPART_CHUNKSIZE = 5 * 1024 * 1024
+_MULTIPART_MAX_CONCURRENCY = 10
+
+# S3/R2 single object upload limit enforced by S3Manager
+_MAX_UPLOAD_SIZE = 25 * 1024 * 1024
+
+# lowest quality the compression will step down to when trying to fit a byte budget
+_MIN_COMPRESS_QUALITY = 35
+
+# gifs are left alone as they are almost always animated and re-encoding would drop the animation,
+# other animated formats (APNG, animated WebP) are detected and skipped by compress_image
+_COMPRESSIBLE_IMAGE_EXTS = frozenset({".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff"})
+
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_JPEG_MAGIC = b"\xff\xd8\xff"
+
+ImageFormat = Literal["JPEG", "WEBP"]
+_IMAGE_FORMAT_SUFFIXES = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+_CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tiff": "image/tiff",
+    ".gif": "image/gif",
+    ".mp4": "video/mp4",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+}
+
 
 class AttachmentHandler:
     """Handle the saving of attachments (images, videos, audio, etc.)
 
     Subclass this to implement your own asset handler."""
 
+    max_concurrency: int = 10
+
     async def process_asset(self, attachment: discord.Attachment) -> discord.Attachment:
         """Implement this to process the asset and return a url to the stored attachment.
         :param attachment: discord.Attachment
@@ -30,15 +72,63 @@ class AttachmentHandler:
         """
         raise NotImplementedError
 
+    async def process_assets(self, attachments: List[discord.Attachment]) -> List[discord.Attachment]:
+        """Process several assets concurrently, at most max_concurrency at a time across all calls on this handler.
+
+        If one asset raises, the ones still outstanding are cancelled before the exception is re-raised.
+        :param attachments: List[discord.Attachment]
+        :return: List[discord.Attachment] - in the same order as the input
+        """
+        semaphore = self._get_semaphore()
+
+        async def _process_one(attachment: discord.Attachment) -> discord.Attachment:
+            async with semaphore:
+                return await self.process_asset(attachment)
+
+        tasks = [asyncio.ensure_future(_process_one(a)) for a in attachments]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """One semaphore per handler (and event loop), as subclasses aren't required to call __init__."""
+        loop = asyncio.get_running_loop()
+        if getattr(self, "_semaphore_loop", None) is not loop:
+            self._semaphore = asyncio.Semaphore(_validate_max_concurrency(self.max_concurrency))
+            self._semaphore_loop = loop
+        return self._semaphore
+
 
 class AttachmentToLocalFileHostHandler(AttachmentHandler):
-    """Save the assets to a local file host and embed the assets in the transcript from there."""
+    """Save the assets to a local file host and embed the assets in the transcript from there.
 
-    def __init__(self, base_path: Union[str, pathlib.Path], url_base: str):
+    If compress_amount (quality, 1-95) is set, images are re-encoded to image_format (JPEG or WEBP) off the event
+    loop before saving. If compress_target_bytes is also set, the quality is stepped down until the image fits in that
+    many bytes."""
+
+    def __init__(
+        self,
+        base_path: Union[str, pathlib.Path],
+        url_base: str,
+        max_concurrency: int = 10,
+        compress_amount: Optional[int] = None,
+        compress_target_bytes: Optional[int] = None,
+        image_format: ImageFormat = "JPEG",
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
         if isinstance(base_path, str):
             base_path = pathlib.Path(base_path)
         self.base_path = base_path
         self.url_base = url_base
+        self.max_concurrency = _validate_max_concurrency(max_concurrency)
+        self.compress_amount = compress_amount
+        self.compress_target_bytes = compress_target_bytes
+        self.image_format = _validate_image_format(image_format)
+        self.executor = executor
 
     async def process_asset(self, attachment: discord.Attachment) -> discord.Attachment:
         """Implement this to process the asset and return a url to the stored attachment.
@@ -46,7 +136,7 @@ class AttachmentToLocalFileHostHandler(AttachmentHandler):
         :return: str
         """
         file_name = urllib.parse.quote_plus(
-            f"{datetime.datetime.utcnow().timestamp()}_{attachment.filename}"
+            f"{attachment.id}_{attachment.filename}"
         )
 
         try:
@@ -54,11 +144,20 @@ class AttachmentToLocalFileHostHandler(AttachmentHandler):
             async with session.get(attachment.url) as res:
                 if res.status != 200:
                     res.raise_for_status()
-                data = io.BytesIO(await res.read())
-                data.seek(0)
+                data = await _read_response(res)
+
+            if self.compress_amount is not None and _is_compressible_image(attachment.filename):
+                compressed = await _compress_image(
+                    data, self.compress_amount, self.compress_target_bytes, self.image_format, self.executor
+                )
+                if compressed is not data:
+                    file_name = _with_format_suffix(file_name, self.image_format)
+                data = compressed
 
             asset_path = self.base_path / file_name
-            await attachment.save(asset_path)
+            await asyncio.get_running_loop().run_in_executor(
+                None, asset_path.write_bytes, data.getvalue()
+            )
         except Exception as e:
             pass  # silently fail...
 
@@ -71,8 +170,9 @@ class AttachmentToLocalFileHostHandler(AttachmentHandler):
 class AttachmentToDiscordChannelHandler(AttachmentHandler):
     """Save the attachment to a discord channel and embed the assets in the transcript from there."""
 
-    def __init__(self, channel: discord.TextChannel):
+    def __init__(self, channel: discord.TextChannel, max_concurrency: int = 10):
         self.channel = channel
+        self.max_concurrency = _validate_max_concurrency(max_concurrency)
 
     async def process_asset(self, attachment: discord.Attachment) -> discord.Attachment:
         """Implement this to process the asset and return a url to the stored attachment.
@@ -80,47 +180,63 @@ class AttachmentToDiscordChannelHandler(AttachmentHandler):
         :return: str
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(attachment.url) as res:
-                    if res.status != 200:
-                        res.raise_for_status()
-                    data = io.BytesIO(await res.read())
-                    data.seek(0)
-                    attach = discord.File(data, attachment.filename)
-                    msg: discord.Message = await self.channel.send(file=attach)
-                    return msg.attachments[0]
+            session = await ClientSessionFactory.create_or_get_session()
+            async with session.get(attachment.url) as res:
+                if res.status != 200:
+                    res.raise_for_status()
+                data = await _read_response(res)
+
+            attach = discord.File(data, attachment.filename)
+            msg: discord.Message = await self.channel.send(file=attach)
+            return msg.attachments[0]
         except discord.errors.HTTPException as e:
             # discords http errors, including missing permissions
             raise e
 
 
+@functools.lru_cache(maxsize=1)
+def _get_aiobotocore_session() -> AioSession:
+    """Load the .env file and create the aiobotocore session once, on first use."""
+    load_dotenv()
+    return get_session()
+
+
 class AsyncS3ClientManager(AttachmentHandler):
     """Singleton factory for aiobotocore Cloudflare R2 client.
     Auto obtains from environment variables:
     - AWS_ENDPOINT_URL
     - AWS_ACCESS_KEY_ID
     - AWS_SECRET_ACCESS_KEY
+
+    The variables (and any .env file) are read when the client is first created rather than at import time, set the
+    class attributes to override them.
     """
 
-    load_dotenv()
-    endpoint_url = os.getenv("AWS_ENDPOINT_URL")
-    r2_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
-    r2_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+    endpoint_url: Optional[str] = None
+    r2_access_key_id: Optional[str] = None
+    r2_secret_access_key: Optional[str] = None
     _client = None
     _context = None
+    _lock: Optional[asyncio.Lock] = None
 
     @classmethod
     async def get_client(cls):
         """Get or create the singleton context manager interface."""
         if cls._client is None:
-            session = get_session()
-            cls._context = session.create_client(
-                service_name="s3",
-                endpoint_url=cls.endpoint_url,
-                aws_access_key_id=cls.r2_access_key_id,
-                aws_secret_access_key=cls.r2_secret_access_key,
-            )
-            cls._client = await cls._context.__aenter__()
+            if cls._lock is None:
+                cls._lock = asyncio.Lock()
+            # concurrent first callers would otherwise each create (and leak) their own client
+            async with cls._lock:
+                if cls._client is None:
+                    session = _get_aiobotocore_session()
+                    context = session.create_client(
+                        service_name="s3",
+                        endpoint_url=cls.endpoint_url or os.getenv("AWS_ENDPOINT_URL"),
+                        aws_access_key_id=cls.r2_access_key_id or os.getenv("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=cls.r2_secret_access_key or os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    )
+                    cls._client = await context.__aenter__()
+                    cls._context = context
         if not cls._client:
             raise ConnectionError(
                 "Could not obtain S3 client - Check your environment variables."
@@ -144,17 +260,23 @@ class S3Manager:
         self.client = aiobotocore_s3_client
         self.s3 = None
 
-    async def get_all_keys(self) -> List[str]:
+    async def _ensure_client(self) -> None:
+        """Obtain the singleton client the first time it is needed."""
         if self.client is None:
             self.client = await AsyncS3ClientManager.get_client()
 
-        response = await self.client.list_objects_v2(Bucket=self.bucket)
-        objects = []
-        if "Contents" in response:
-            for obj in response["Contents"]:
+    async def iter_keys(self) -> AsyncIterator[str]:
+        """Yield every key in the bucket, following the list_objects_v2 continuation tokens page by page."""
+        await self._ensure_client()
+
+        paginator = self.client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket):
+            for obj in page.get("Contents", ()):
                 if "Key" in obj:
-                    objects.append(obj["Key"])
-        return objects
+                    yield obj["Key"]
+
+    async def get_all_keys(self) -> List[str]:
+        return [key async for key in self.iter_keys()]
 
     async def upload_file_data(
         self,
@@ -176,17 +298,66 @@ class S3Manager:
             raise TypeError("Warning: Attachment data must be bytes or io.BytesIO")
         if isinstance(data, io.BytesIO):
             data.seek(0)
-        if _get_data_size(data) > 25 * 1024 * 1024:
+        size = _get_data_size(data)
+        if not await self._prepare_upload(key_name, size, overwrite, skip_files_which_are_too_large):
+            return
+
+        content_type = self._get_content_type(key_name)
+
+        if size > _MULTIPART_THRESHOLD:
+            raw = data.getvalue() if isinstance(data, io.BytesIO) else data
+            await self._multipart_upload(_iter_bytes_parts(raw), key_name, content_type)
+            return
+
+        await self.client.put_object(
+            Body=data, Bucket=self.bucket, Key=key_name, ContentType=content_type
+        )
+
+    async def upload_stream(
+        self,
+        stream: aiohttp.StreamReader,
+        size: int,
+        key_name: str,
+        overwrite: bool = False,
+        skip_files_which_are_too_large: bool = False,
+    ) -> None:
+        """Upload an async byte stream of known size (e.g. an aiohttp response body) to Cloudflare R2/ s3 as it is
+        read, without buffering the whole object in memory first.
+
+        Only objects above _MULTIPART_THRESHOLD are streamed, as a multipart upload of plain bytes parts which botocore
+        can retry. Smaller objects are read in full and sent with put_object, as a stream body can't be rewound.
+
+        RAISES:
+        >>> FileExistsError # if overwrite is False and file exists.
+        >>> ValueError # if file size exceeds 25MB.
+        """
+        if not await self._prepare_upload(key_name, size, overwrite, skip_files_which_are_too_large):
+            return
+
+        content_type = self._get_content_type(key_name)
+
+        if size > _MULTIPART_THRESHOLD:
+            await self._multipart_upload(_iter_stream_parts(stream, size), key_name, content_type)
+            return
+
+        await self.client.put_object(
+            Body=await stream.readexactly(size), Bucket=self.bucket, Key=key_name, ContentType=content_type
+        )
+
+    async def _prepare_upload(
+        self, key_name: str, size: int, overwrite: bool, skip_files_which_are_too_large: bool
+    ) -> bool:
+        """Run the checks shared by all uploads. Returns False if the upload should be skipped."""
+        if size > _MAX_UPLOAD_SIZE:
             if skip_files_which_are_too_large:
                 logger.warning(f"File {key_name} exceeds 25MB limit, skipping upload.")
-                return
+                return False
             raise ValueError("File size exceeds 25MB limit.")
 
-        if self.client is None:
-            self.client = await AsyncS3ClientManager.get_client()
+        await self._ensure_client()
         try:
             if not overwrite:
-                obj = await self.client.get_object(Bucket=self.bucket, Key=key_name)
+                obj = await self.client.head_object(Bucket=self.bucket, Key=key_name)
                 if obj is not None:
                     try:
                         status = obj["ResponseMetadata"]["HTTPStatusCode"]
@@ -194,77 +365,97 @@ class S3Manager:
                         logger.warning(
                             "Could not determine if object exists, blocking upload."
                         )
-                        return
+                        return False
                     if status == 200:
                         raise FileExistsError(
                             f"Object with key {key_name} already exists in bucket {self.bucket}."
                         )  # raise bespoke error?
 
-        except self.client.exceptions.NoSuchKey:
-            pass  # we can proceed to upload as the object does not exist
+        except ClientError as e:
+            if not _is_missing_key_error(e):
+                raise
+            # we can proceed to upload as the object does not exist
+        return True
 
-        content_type = self._get_content_type(key_name)
+    async def _multipart_upload(
+        self, parts: AsyncIterator[bytes], key_name: str, content_type: str
+    ) -> None:
+        """Upload the parts as they are produced, sending up to _MULTIPART_MAX_CONCURRENCY parts at a time.
 
-        await self.client.put_object(
-            Body=data, Bucket=self.bucket, Key=key_name, ContentType=content_type
+        The multipart upload is aborted if any part fails, so no orphaned parts are left in the bucket."""
+        upload = await self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key_name, ContentType=content_type
         )
+        upload_id = upload["UploadId"]
+        # acquired before a part is handed off and released once it is uploaded, which also bounds
+        # how many parts are held in memory while reading from a stream
+        semaphore = asyncio.Semaphore(_MULTIPART_MAX_CONCURRENCY)
+
+        async def _upload_part(part_number: int, body: bytes) -> dict:
+            try:
+                part = await self.client.upload_part(
+                    Body=body,
+                    Bucket=self.bucket,
+                    Key=key_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                )
+            finally:
+                semaphore.release()
+            return {"ETag": part["ETag"], "PartNumber": part_number}
+
+        tasks: List[asyncio.Task] = []
+        try:
+            part_number = 1
+            async for body in parts:
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(_upload_part(part_number, body)))
+                part_number += 1
+            uploaded_parts = await asyncio.gather(*tasks)
+            await self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key_name,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": list(uploaded_parts)},
+            )
+        except BaseException:
+            # BaseException so a cancelled upload (e.g. a sibling asset failed) is aborted too
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await asyncio.shield(
+                    self.client.abort_multipart_upload(
+                        Bucket=self.bucket, Key=key_name, UploadId=upload_id
+                    )
+                )
+            except Exception as e:
+                # don't mask the original exception
+                logger.warning(f"Could not abort multipart upload {upload_id} of {key_name}: {e}")
+            raise
 
     async def delete_files_in_list(self, files_to_delete: List[str]) -> None:
-        """Delete all files from Cloudflare R2/s3 that start with the given prefix.
+        """Delete all the given keys from Cloudflare R2/s3.
 
-        Can Raise AssertionError if deletion fails."""
-        if self.client is None:
-            self.client = await AsyncS3ClientManager.get_client()
+        Keys which do not exist are ignored by delete_objects, so they are not checked for beforehand."""
+        await self._ensure_client()
 
         logger.info(f"Deleting files with from bucket {self.bucket}")
-        keys_to_delete = []
-
-        for file_key in files_to_delete:
-            if len(keys_to_delete) >= 1000:
-                break  # will loop again to delete more
-            try:
-                obj = await self.client.get_object(Bucket=self.bucket, Key=file_key)
-            except self.client.exceptions.NoSuchKey:
-                continue  # file does not exist, skip
-            if obj is not None:
-                keys_to_delete.append({"Key": file_key})
+        keys_to_delete = files_to_delete[:1000]
 
         if keys_to_delete:
             deleted_response = await self.client.delete_objects(
                 Bucket=self.bucket,
-                Delete={"Objects": [{"Key": obj["Key"]} for obj in keys_to_delete]},
+                Delete={"Objects": [{"Key": key} for key in keys_to_delete]},
             )
             logger.debug(f"Deleted objects response: {deleted_response}")
-            if len(keys_to_delete) > 1000:
+            if len(files_to_delete) > 1000:
                 # Cloudflare R2/s3 delete_objects can only delete up to 1000 objects at a time so recursively call.
                 logger.debug(f"Recursively deleting more than 1000 objects")
-                await self.delete_files_in_list(keys_to_delete)
+                await self.delete_files_in_list(files_to_delete[1000:])
 
     def _get_content_type(self, file_name: str) -> str:
-        _image_exts = [
-            ".png",
-            ".jpg",
-            ".jpeg",
-            ".webp",
-            ".bmp",
-            ".tiff",
-            ".gif",
-        ]
-        if any(file_name.lower().endswith(ext) for ext in _image_exts):
-            for ext in _image_exts:
-                content_type = f"image/{ext.lstrip('.')}"
-                break
-        elif file_name.lower().endswith(".mp4"):
-            content_type = "video/mp4"
-        elif file_name.lower().endswith(".mp3"):
-            content_type = "audio/mpeg"
-        elif file_name.lower().endswith(".wav"):
-            content_type = "audio/wav"
-        elif file_name.lower().endswith(".ogg"):
-            content_type = "audio/ogg"
-        else:
-            content_type = "html/text"
-        return content_type
+        return _CONTENT_TYPES.get(os.path.splitext(file_name)[1].lower(), "application/octet-stream")
 
 
 class AttachmentToS3Handler(AttachmentHandler):
@@ -274,6 +465,10 @@ class AttachmentToS3Handler(AttachmentHandler):
     
     If an error occurs during upload, and raise_exceptions is False, the original attachment is returned.
 
+    If compress_amount (quality, 1-95) is set, images are re-encoded to image_format (JPEG or WEBP) before upload.
+    Encoding runs in executor, or the default thread pool if None, so it does not block the event loop. The quality is
+    stepped down until the image fits in compress_target_bytes, which is capped at the 25MB upload limit.
+
     Auto obtain the following from environment variables:
 
         - AWS_ENDPOINT_URL
@@ -300,14 +495,25 @@ class AttachmentToS3Handler(AttachmentHandler):
         key_prefix: str = "",
         skip_files_which_are_too_large: bool = False,
         raise_exceptions: bool = False,
+        max_concurrency: int = 10,
+        compress_amount: Optional[int] = None,
+        compress_target_bytes: Optional[int] = None,
+        image_format: ImageFormat = "JPEG",
+        executor: Optional[concurrent.futures.Executor] = None,
     ):
         self.s3_client = aiobotocore_s3_client
         self.bucket_name = bucket_name
         self.key_prefix = key_prefix
         self.skip_files_which_are_too_large = skip_files_which_are_too_large
         self.raise_exceptions = raise_exceptions
+        self.max_concurrency = _validate_max_concurrency(max_concurrency)
+        self.compress_amount = compress_amount
+        self.compress_target_bytes = compress_target_bytes
+        self.image_format = _validate_image_format(image_format)
+        self.executor = executor
 
         self.uploaded_keys: List[str] = []
+        self._s3_manager: Optional[S3Manager] = None
 
     async def process_asset(self, attachment: discord.Attachment) -> discord.Attachment:
         """Implement this to process the asset and return a url to the stored attachment.
@@ -318,65 +524,115 @@ class AttachmentToS3Handler(AttachmentHandler):
         :return: str
         """
         file_name = urllib.parse.quote_plus(
-            f"{datetime.datetime.utcnow().timestamp()}_{attachment.filename}"
+            f"{attachment.id}_{attachment.filename}"
         )
 
         data: Optional[io.BytesIO] = None
-        #
-
-        try:
-            session = await ClientSessionFactory.create_or_get_session()
-            async with session.get(attachment.url) as res:
+        stream: Optional[aiohttp.StreamReader] = None
+        stream_size = 0
+        compress = self.compress_amount is not None and _is_compressible_image(attachment.filename)
+
+        # discord already tells us the size, so don't download files which would only be rejected on upload
+        if (
+            self.skip_files_which_are_too_large
+            and not compress
+            and (getattr(attachment, "size", 0) or 0) > _MAX_UPLOAD_SIZE
+        ):
+            logger.warning(f"File {attachment.filename} exceeds 25MB limit, skipping download and upload.")
+            return attachment
+
+        # the response is only released once the upload has finished with it
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                session = await ClientSessionFactory.create_or_get_session()
+                res = await stack.enter_async_context(session.get(attachment.url))
                 if res.status != 200:
                     res.raise_for_status()
-                data = io.BytesIO(await res.read())
-                data.seek(0)
-        except Exception as e:
-            if self.raise_exceptions:
-                raise e
-            else:
-                logger.error(
-                    f"[raise_exception] is False and an {e} exception was hit getting and converting data to io.BytesIO. Continuing..."
-                )
-                return attachment
-
-        # upload to s3 / r2 bucket
-        if data is not None:
-            self.key_prefix = self.key_prefix.removesuffix(
-                "/"
-            )  # ensure no trailing slash for combining.
-            key = f"{self.key_prefix}/{file_name}" if self.key_prefix else file_name
-            try:
-                s3_manager = S3Manager(self.s3_client, self.bucket_name)
-                await s3_manager.upload_file_data(
-                    data=data,
-                    key_name=key,
-                    overwrite=True,
-                    skip_files_which_are_too_large=self.skip_files_which_are_too_large,
-                )
+
+                if (
+                    not compress
+                    and res.content_length is not None
+                    and res.content_length > _MULTIPART_THRESHOLD
+                    and "Content-Encoding" not in res.headers
+                ):
+                    # large files are uploaded as they are, so pipe them straight through to the bucket part by part
+                    stream = res.content
+                    stream_size = res.content_length
+                else:
+                    data = await _read_response(res)
+                    res.release()
+
+                if compress:
+                    # always aim below the upload limit so oversized images are shrunk rather than rejected
+                    compressed = await _compress_image(
+                        data,
+                        self.compress_amount,
+                        self.compress_target_bytes,
+                        self.image_format,
+                        self.executor,
+                        max_bytes=_MAX_UPLOAD_SIZE,
+                    )
+                    if compressed is not data:
+                        file_name = _with_format_suffix(file_name, self.image_format)
+                    data = compressed
             except Exception as e:
-                logger.error(
-                    f"Error uploading to S3/R2: {e} - deleting the uploaded files from cloudflare R2/S3 bucket - Try again? "
-                )
                 if self.raise_exceptions:
-                    await s3_manager.delete_files_in_list(self.uploaded_keys)
                     raise e
                 else:
                     logger.error(
-                        f"[raise_exception] is False and an {e} exception was hit uploading the data to the Object Storage. Continuing..."
+                        f"[raise_exception] is False and an {e} exception was hit getting and converting data to io.BytesIO. Continuing..."
                     )
                     return attachment
-        else:
-            if self.raise_exceptions:
-                raise ValueError(
-                    "Could not obtain data to upload to S3/R2 bucket - This shouldn't have even been hit.."
-                )
 
+            # upload to s3 / r2 bucket
+            if data is not None or stream is not None:
+                self.key_prefix = self.key_prefix.removesuffix(
+                    "/"
+                )  # ensure no trailing slash for combining.
+                key = f"{self.key_prefix}/{file_name}" if self.key_prefix else file_name
+                try:
+                    if self._s3_manager is None:
+                        self._s3_manager = S3Manager(self.s3_client, self.bucket_name)
+                        await self._s3_manager._ensure_client()
+                    if stream is not None:
+                        await self._s3_manager.upload_stream(
+                            stream=stream,
+                            size=stream_size,
+                            key_name=key,
+                            overwrite=True,
+                            skip_files_which_are_too_large=self.skip_files_which_are_too_large,
+                        )
+                    else:
+                        await self._s3_manager.upload_file_data(
+                            data=data,
+                            key_name=key,
+                            overwrite=True,
+                            skip_files_which_are_too_large=self.skip_files_which_are_too_large,
+                        )
+                except Exception as e:
+                    logger.error(
+                        f"Error uploading to S3/R2: {e} - deleting the uploaded files from cloudflare R2/S3 bucket - Try again? "
+                    )
+                    if self.raise_exceptions:
+                        if self._s3_manager is not None:
+                            await self._s3_manager.delete_files_in_list(self.uploaded_keys)
+                        raise e
+                    else:
+                        logger.error(
+                            f"[raise_exception] is False and an {e} exception was hit uploading the data to the Object Storage. Continuing..."
+                        )
+                        return attachment
             else:
-                logger.error(
-                    f"[raise_exception] is False and an ValueError exception was hit as data was None, this shouldn't even be hit. Continuing..."
-                )
-                return attachment
+                if self.raise_exceptions:
+                    raise ValueError(
+                        "Could not obtain data to upload to S3/R2 bucket - This shouldn't have even been hit.."
+                    )
+
+                else:
+                    logger.error(
+                        f"[raise_exception] is False and an ValueError exception was hit as data was None, this shouldn't even be hit. Continuing..."
+                    )
+                    return attachment
 
         file_url = f"/{self.key_prefix}/{file_name}"
         attachment.url = file_url
@@ -385,10 +641,158 @@ class AttachmentToS3Handler(AttachmentHandler):
 
 
 def _get_data_size(data: Union[io.BytesIO, bytes]) -> int:
-    """Get the size of the data in bytes."""
+    """Get the size of the data in bytes.
+
+    Seeks to the end rather than using getbuffer(), which exports a view of the buffer (blocking it from being
+    resized until released) and can force a copy of the underlying bytes."""
     if isinstance(data, io.BytesIO):
-        return data.getbuffer().nbytes
-    elif isinstance(data, bytes):
+        position = data.tell()
+        size = data.seek(0, io.SEEK_END)
+        data.seek(position)
+        return size
+    elif isinstance(data, (bytes, bytearray, memoryview)):
         return len(data)
     else:
         raise TypeError(f"Unsupported data type: {type(data)}")
+
+
+async def _iter_bytes_parts(raw: bytes) -> AsyncIterator[bytes]:
+    """Split in memory data in to multipart upload sized parts."""
+    for offset in range(0, len(raw), _MULTIPART_CHUNKSIZE):
+        yield raw[offset:offset + _MULTIPART_CHUNKSIZE]
+
+
+async def _iter_stream_parts(stream: aiohttp.StreamReader, size: int) -> AsyncIterator[bytes]:
+    """Read multipart upload sized parts from the stream, only one part is read ahead at a time."""
+    remaining = size
+    while remaining > 0:
+        part = await stream.readexactly(min(_MULTIPART_CHUNKSIZE, remaining))
+        remaining -= len(part)
+        yield part
+
+
+def _is_missing_key_error(error: ClientError) -> bool:
+    """head_object reports a missing key as a bare 404 rather than NoSuchKey, so check for both."""
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+async def _read_response(res: aiohttp.ClientResponse) -> io.BytesIO:
+    """Stream the response body into a buffer in chunks rather than in one large read."""
+    data = io.BytesIO()
+    async for chunk in res.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+        data.write(chunk)
+    data.seek(0)
+    return data
+
+
+def _is_compressible_image(file_name: str) -> bool:
+    """Check whether the file is an image which can be re-encoded."""
+    return os.path.splitext(file_name)[1].lower() in _COMPRESSIBLE_IMAGE_EXTS
+
+
+def _validate_max_concurrency(max_concurrency: int) -> int:
+    """A semaphore of 0 would never let process_assets start anything, so require at least 1."""
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}.")
+    return max_concurrency
+
+
+def _validate_image_format(image_format: str) -> ImageFormat:
+    """Normalise the case of the format and reject anything compress_image can't encode."""
+    normalised = image_format.upper() if isinstance(image_format, str) else image_format
+    if normalised not in _IMAGE_FORMAT_SUFFIXES:
+        raise ValueError(
+            f"Unsupported image_format {image_format!r}, expected one of {', '.join(_IMAGE_FORMAT_SUFFIXES)}."
+        )
+    return normalised
+
+
+def _with_format_suffix(file_name: str, image_format: ImageFormat) -> str:
+    """Swap the extension of the file name for the one matching the re-encoded data."""
+    return f"{os.path.splitext(file_name)[0]}{_IMAGE_FORMAT_SUFFIXES[image_format]}"
+
+
+def _is_jpeg(data: io.BytesIO) -> bool:
+    """Sniff the JPEG start of image marker rather than trusting the file extension."""
+    position = data.tell()
+    data.seek(0)
+    header = data.read(3)
+    data.seek(position)
+    return header == _JPEG_MAGIC
+
+
+def compress_image(
+    raw: bytes, quality: int, *, target_bytes: Optional[int] = None, image_format: ImageFormat = "JPEG"
+) -> bytes:
+    """Re-encode the image to image_format at the given quality. This is CPU bound, so don't call it on the event loop.
+
+    A pure module level function over bytes, so it can also be dispatched to a ProcessPoolExecutor to spread
+    compression over several cores.
+
+    Animated images, and images with transparency when encoding to JPEG, are returned unchanged as re-encoding them
+    would keep only the first frame or lose the alpha channel.
+
+    If target_bytes is given, the quality is lowered in steps of 5 (down to _MIN_COMPRESS_QUALITY) until the
+    encoded image fits. The last attempt is returned even if it is still too large."""
+    with Image.open(io.BytesIO(raw)) as image:
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if getattr(image, "is_animated", False) or (has_alpha and image_format == "JPEG"):
+            return raw
+        # unlike JPEG, WebP can keep the transparency
+        rgb_image = image.convert("RGBA" if has_alpha else "RGB")
+
+    while True:
+        compressed_data = io.BytesIO()
+        if image_format == "WEBP":
+            # method 6 is the slowest but smallest encoder setting
+            rgb_image.save(compressed_data, format="WEBP", quality=quality, method=6)
+        else:
+            # optimised Huffman tables and progressive scans shrink the output without touching image quality,
+            # at high qualities chroma subsampling is disabled as it would otherwise dominate the loss
+            rgb_image.save(
+                compressed_data,
+                format="JPEG",
+                quality=quality,
+                optimize=True,
+                progressive=True,
+                subsampling=0 if quality >= 90 else 2,
+            )
+        if target_bytes is None or compressed_data.tell() <= target_bytes:
+            break
+        if quality - 5 < _MIN_COMPRESS_QUALITY:
+            break
+        quality -= 5
+
+    return compressed_data.getvalue()
+
+
+async def _compress_image(
+    data: io.BytesIO,
+    quality: int,
+    target_bytes: Optional[int] = None,
+    image_format: ImageFormat = "JPEG",
+    executor: Optional[concurrent.futures.Executor] = None,
+    max_bytes: Optional[int] = None,
+) -> io.BytesIO:
+    """Compress the image in the given executor (default thread pool if None) to keep the event loop free.
+
+    target_bytes is the user's byte budget, max_bytes a hard ceiling (e.g. the upload limit) which only caps how far
+    the quality is stepped down. When encoding to JPEG with a budget set, JPEGs which already fit it are returned
+    untouched, as re-encoding them would only cost CPU time and add another generation of compression artifacts.
+    The same data object is returned whenever the image was left as it is, so callers can tell it wasn't re-encoded."""
+    budget = target_bytes if max_bytes is None else min(target_bytes or max_bytes, max_bytes)
+    if (
+        image_format == "JPEG"
+        and target_bytes is not None
+        and _is_jpeg(data)
+        and _get_data_size(data) <= budget
+    ):
+        return data
+    raw = data.getvalue()
+    compressed = await asyncio.get_running_loop().run_in_executor(
+        executor,
+        functools.partial(compress_image, raw, quality, target_bytes=budget, image_format=image_format),
+    )
+    if compressed == raw:
+        return data  # skipped by compress_image, e.g. an animated image
+    return io.BytesIO(compressed)
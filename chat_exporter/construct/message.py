@@ -1,7 +1,7 @@
 import html
 import io
 import traceback
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import aiohttp
 from pytz import timezone
@@ -69,7 +69,8 @@ class MessageConstruct:
         guild: discord.Guild,
         meta_data: dict,
         message_dict: dict,
-        attachment_handler: Optional[AttachmentHandler]
+        attachment_handler: Optional[AttachmentHandler],
+        processed_attachments: Optional[List[discord.Attachment]] = None
     ):
         self.message = message
         self.previous_message = previous_message
@@ -78,6 +79,7 @@ class MessageConstruct:
         self.guild = guild
         self.message_dict = message_dict
         self.attachment_handler = attachment_handler
+        self.processed_attachments = processed_attachments
         self.time_format = "%A, %e %B %Y %I:%M %p"
         if self.military_time:
             self.time_format = "%A, %e %B %Y %H:%M"
@@ -271,9 +273,13 @@ class MessageConstruct:
         for e in self.message.embeds:
             self.embeds += await Embed(e, self.guild).flow()
 
-        for a in self.message.attachments:
-            if self.attachment_handler and isinstance(self.attachment_handler, AttachmentHandler):
-                a = await self.attachment_handler.process_asset(a)
+        attachments = self.message.attachments
+        if self.processed_attachments is not None:
+            attachments = self.processed_attachments
+        elif attachments and self.attachment_handler and isinstance(self.attachment_handler, AttachmentHandler):
+            attachments = await self.attachment_handler.process_assets(attachments)
+
+        for a in attachments:
             self.attachments += await Attachment(a, self.guild).flow()
 
         for c in self.message.components:
@@ -481,6 +487,8 @@ async def gather_messages(
         messages[0] = message
         messages[0].reference = None
 
+    processed_attachments = await _process_attachments(messages, attachment_handler)
+
     for message in messages:
         content_html, meta_data = await MessageConstruct(
             message,
@@ -491,6 +499,7 @@ async def gather_messages(
             meta_data,
             message_dict,
             attachment_handler,
+            processed_attachments.get(message.id),
             ).construct_message()
 
         message_html += content_html
@@ -498,3 +507,30 @@ async def gather_messages(
 
     message_html += "</div>"
     return message_html, meta_data
+
+
+async def _process_attachments(
+    messages: List[discord.Message],
+    attachment_handler: Optional[AttachmentHandler],
+) -> Dict[int, List[discord.Attachment]]:
+    """Hand the attachments of every message to the handler in one batch, so they are processed concurrently across
+    the whole transcript rather than one message at a time."""
+    if not attachment_handler or not isinstance(attachment_handler, AttachmentHandler):
+        return {}
+
+    # these message types are rendered without their assets, so their attachments are never shown
+    skipped_types = (
+        discord.MessageType.pins_add,
+        discord.MessageType.thread_created,
+        discord.MessageType.recipient_remove,
+        discord.MessageType.recipient_add,
+    )
+    with_attachments = [m for m in messages if m.attachments and m.type not in skipped_types]
+    processed = await attachment_handler.process_assets([a for m in with_attachments for a in m.attachments])
+
+    processed_attachments: Dict[int, List[discord.Attachment]] = {}
+    offset = 0
+    for message in with_attachments:
+        processed_attachments[message.id] = processed[offset:offset + len(message.attachments)]
+        offset += len(message.attachments)
+    return processed_attachments
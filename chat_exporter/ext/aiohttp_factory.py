@@ -9,7 +9,16 @@ class ClientSessionFactory:
     @classmethod
     async def create_or_get_session(cls) -> aiohttp.ClientSession:
         if cls._session is None or cls._session.closed:
-            cls._session = aiohttp.ClientSession()
+            # keep DNS lookups and idle connections to the CDN around between attachments
+            connector = aiohttp.TCPConnector(
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+            )
+            cls._session = aiohttp.ClientSession(
+                connector=connector,
+                # no total cap, as streamed attachments stay open while they upload, but never hang on a stalled socket
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60),
+            )
         return cls._session
 
     @classmethod